@@ -26,33 +26,56 @@ connection = Connection(base_url=organization_url, creds=credentials)
 
 def get_last_n_build(args):
     asset_builds = []
+    pattern = args.pattern.lower() if args.pattern else None
     build_client = connection.clients.get_build_client()
-    builds = build_client.get_builds(
-        project=Project_Name,
-        definitions=[AzureML_Assets_Build_Definition_ID],
-        branch_name=Main_Branch_Name,
-    )
-    for build in builds:
-        build_item = {}
-        build_item["build_number"] = build.build_number
-        build_item["build_id"] = build.id
-        build_item["build_created_by"] = build.requested_by.display_name
-        build_item["build_requested_by"] = build.requested_by.unique_name
-        build_parameters = json.loads(build.parameters)
-        build_item["build_pattern"] = build_parameters.get("pattern", "N/A")
-        build_item["build_time"] = build.finish_time
-        build_item["build_result"] = build.result
-        if args.succeeded and build.result != "succeeded":
-            continue
-        build_item["build_status"] = build.status
-        build_item["build_url"] = (
-            f"https://dev.azure.com/msdata/Vienna/_build/results?buildId={build.id}&view=results"
+    # Let the server filter and order builds, and over-fetch to cover pattern misses
+    top = args.number if pattern is None else args.number * 5
+    max_time = None
+    seen_build_ids = set()
+    while len(asset_builds) < args.number:
+        builds = build_client.get_builds(
+            project=Project_Name,
+            definitions=[AzureML_Assets_Build_Definition_ID],
+            branch_name=Main_Branch_Name,
+            top=top,
+            max_time=max_time,
+            status_filter="completed" if args.succeeded else None,
+            result_filter="succeeded" if args.succeeded else None,
+            query_order="finishTimeDescending",
         )
-
-        if (args.pattern is None or args.pattern.lower() in build_item["build_pattern"].lower()):
-            asset_builds.append(build_item)
-
-    return asset_builds[:args.number]
+        # max_time is inclusive, so skip builds already seen on the previous page
+        new_builds = [build for build in builds if build.id not in seen_build_ids]
+        if not new_builds:
+            break
+
+        for build in new_builds:
+            seen_build_ids.add(build.id)
+            if build.finish_time is not None:
+                max_time = build.finish_time
+            build_item = {}
+            build_item["build_number"] = build.build_number
+            build_item["build_id"] = build.id
+            build_item["build_created_by"] = build.requested_by.display_name
+            build_item["build_requested_by"] = build.requested_by.unique_name
+            build_parameters = json.loads(build.parameters)
+            build_item["build_pattern"] = build_parameters.get("pattern", "N/A")
+            build_item["build_time"] = build.finish_time
+            build_item["build_result"] = build.result
+            build_item["build_status"] = build.status
+            build_item["build_url"] = (
+                f"https://dev.azure.com/msdata/Vienna/_build/results?buildId={build.id}&view=results"
+            )
+
+            if (pattern is None or pattern in build_item["build_pattern"].lower()):
+                asset_builds.append(build_item)
+                if len(asset_builds) >= args.number:
+                    break
+
+        # A short page means there are no older builds left
+        if len(builds) < top:
+            break
+
+    return asset_builds
 
 
 def main():
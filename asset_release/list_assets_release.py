@@ -1,6 +1,7 @@
 import argparse
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from azure.devops.connection import Connection
 from msrest.authentication import BasicAuthentication
@@ -19,6 +20,9 @@ AzureML_Assets_Build_Definition_ID = 25490
 
 Last_N_Releases = 1
 
+# Cap concurrent release/build lookups to stay clear of Azure DevOps throttling
+Max_Workers = 8
+
 # Create a connection to the org
 credentials = BasicAuthentication("", personal_access_token)
 connection = Connection(base_url=organization_url, creds=credentials)
@@ -26,6 +30,7 @@ connection = Connection(base_url=organization_url, creds=credentials)
 
 def get_last_n_releases(args):
     asset_releases = []
+    pattern = args.pattern.lower() if args.pattern else None
 
     # Get a release client
     release_client = connection.clients.get_release_client()
@@ -34,55 +39,70 @@ def get_last_n_releases(args):
     # Get a build client
     build_client = connection.clients.get_build_client()
 
-    while True:
-        print(">", end="", flush=True)
-
-        releases = release_client.get_releases(
-            project=Project_Name,
-            definition_id=AzureML_Assets_Release_Definition_ID,
-            top=10,
-            max_created_time=max_created_time,
-        )
-
-        if releases is not None:
-            for release in releases:
-                rls_item = {}
-                rls = release_client.get_release(
-                    project=Project_Name, release_id=release.id
-                )
-                rls_item["release_name"] = rls.name
-                rls_item["release_time"] = rls.created_on
-                max_created_time = (
-                    rls.created_on
-                    if max_created_time is None or rls.created_on < max_created_time
-                    else max_created_time
-                )
-                rls_item["release_status"] = rls.status
-                rls_item["release_created_by"] = rls.created_by.display_name
-                rls_item["release_description"] = rls.description
-                rls_item["release_url"] = (
-                    f"https://msdata.visualstudio.com/Vienna/_releaseProgress?_a=release-pipeline-progress&releaseId={release.id}"
-                )
-                artifact = rls.artifacts[0]
-                rls_build_id = artifact.definition_reference["version"].id
-                build = build_client.get_build(
-                    project=Project_Name, build_id=rls_build_id
-                )
-                queue_time_variables = json.loads(build.parameters)
-                rls_item["build_version"] = build.build_number
-                rls_item["build_pattern"] = queue_time_variables["pattern"]
-                if (
-                    args.pattern is None
-                    or args.pattern.lower() in rls_item["build_pattern"].lower()
-                ):
-                    asset_releases.append(rls_item)
+    # Request enough releases to satisfy most pattern filters in one page
+    top = max(args.number * 2, 50)
+
+    def fetch(release):
+        artifact = release.artifacts[0]
+        rls_build_id = artifact.definition_reference["version"].id
+        build = build_client.get_build(project=Project_Name, build_id=rls_build_id)
+        return release, build
+
+    with ThreadPoolExecutor(max_workers=Max_Workers) as executor:
+        while len(asset_releases) < args.number:
+            print(">", end="", flush=True)
+
+            # Expanding artifacts makes the list response carry everything
+            # needed, so there is no per-release get_release call.
+            releases = release_client.get_releases(
+                project=Project_Name,
+                definition_id=AzureML_Assets_Release_Definition_ID,
+                top=top,
+                max_created_time=max_created_time,
+                expand="artifacts",
+            )
+
+            if not releases:
+                break
+
+            # Fetch build details concurrently, one batch of workers at a time,
+            # so that no more builds are fetched than needed
+            releases = sorted(releases, key=lambda rls: rls.created_on, reverse=True)
+            for start in range(0, len(releases), Max_Workers):
+                batch = releases[start : start + Max_Workers]
+                for rls, build in executor.map(fetch, batch):
+                    rls_item = {}
+                    rls_item["release_name"] = rls.name
+                    rls_item["release_time"] = rls.created_on
+                    max_created_time = (
+                        rls.created_on
+                        if max_created_time is None or rls.created_on < max_created_time
+                        else max_created_time
+                    )
+                    rls_item["release_status"] = rls.status
+                    rls_item["release_created_by"] = rls.created_by.display_name
+                    rls_item["release_description"] = rls.description
+                    rls_item["release_url"] = (
+                        f"https://msdata.visualstudio.com/Vienna/_releaseProgress?_a=release-pipeline-progress&releaseId={rls.id}"
+                    )
+                    queue_time_variables = json.loads(build.parameters)
+                    rls_item["build_version"] = build.build_number
+                    rls_item["build_pattern"] = queue_time_variables["pattern"]
+                    if (
+                        pattern is None
+                        or pattern in rls_item["build_pattern"].lower()
+                    ):
+                        asset_releases.append(rls_item)
+                    if len(asset_releases) >= args.number:
+                        break
                 if len(asset_releases) >= args.number:
-                    print("")
-                    return asset_releases[: args.number]
-        else:
-            break
+                    break
+
+            # A short page means there are no older releases left
+            if len(releases) < top:
+                break
     print("")
-    return asset_releases[: args.number]
+    return asset_releases
 
 
 def main():
@@ -1,6 +1,8 @@
 import argparse
 import datetime
+import functools
 
+import requests
 from azure.devops.connection import Connection
 from azure.devops.released.work import TeamContext
 from msrest.authentication import BasicAuthentication
@@ -23,6 +25,15 @@ work_item_types = ["Task", "Bug"]
 # Define the work item states that should NOT be changed
 work_item_state = ["Done", "Resolved", "Removed"]
 
+# Maximum number of work items Azure DevOps handles in one get_work_items or $batch call
+work_item_batch_size = 200
+
+# Seconds to wait when connecting to and reading from the $batch endpoint
+batch_request_timeout = (10, 120)
+
+# REST API version of the $batch request and of each work item update in it
+api_version = "7.1"
+
 
 organization_url = "https://dev.azure.com/msdata"
 project_name = "Vienna"
@@ -33,6 +44,7 @@ connection = Connection(base_url=organization_url, creds=credentials)
 
 
 # Get the project id
+@functools.lru_cache(maxsize=None)
 def get_project_id(project_name):
     core_client = connection.clients.get_core_client()
     for project in core_client.get_projects():
@@ -43,6 +55,7 @@ def get_project_id(project_name):
 
 
 # Get the team id
+@functools.lru_cache(maxsize=None)
 def get_team_id(project_name, team_name):
     project_id = get_project_id(project_name)
     if not project_id:
@@ -63,41 +76,19 @@ def get_team_id(project_name, team_name):
     return None
 
 
-# Find the current sprint
-def get_current_sprint(project_name, team_name):
-    project_id = get_project_id(project_name)
-    if not project_id:
-        raise Exception(f"Project {project_name} not found")
-    team_id = get_team_id(project_name, team_name)
-    if not team_id:
-        raise Exception(f"Team {team_name} not found")
-
-    team_context = TeamContext(project_id=project_id, team_id=team_id)
-    today = datetime.datetime.now(datetime.UTC)
-    work_client = connection.clients.get_work_client()
-    for iteration in work_client.get_team_iterations(team_context):
-        if iteration.attributes.start_date <= today <= iteration.attributes.finish_date:
-            return iteration.path
-    return None
-
-
-# Find future sprints
-def get_future_sprints(project_name, team_name):
-    project_id = get_project_id(project_name)
-    if not project_id:
-        raise Exception(f"Project {project_name} not found")
-    team_id = get_team_id(project_name, team_name)
-    if not team_id:
-        raise Exception(f"Team {team_name} not found")
-
+# Find the current and future sprints in a single pass over the team iterations
+def get_sprints(project_id, team_id):
     team_context = TeamContext(project_id=project_id, team_id=team_id)
     today = datetime.datetime.now(datetime.UTC)
     work_client = connection.clients.get_work_client()
+    current_sprint = None
     future_sprints = []
     for iteration in work_client.get_team_iterations(team_context):
         if iteration.attributes.start_date > today:
             future_sprints.append(iteration.path)
-    return future_sprints
+        elif today <= iteration.attributes.finish_date and current_sprint is None:
+            current_sprint = iteration.path
+    return current_sprint, future_sprints
 
 
 def other_sprint_wits(excluded_sprints, assigned_to):
@@ -136,9 +127,62 @@ def move_wit_to_current_sprint(work_items, current_sprint):
         wit_client.update_work_item(document, work_item_id)
 
 
-def get_wit_by_id(work_item_id):
+# Move work items with the $batch endpoint, one request per batch of work items
+def move_wit_to_current_sprint_batch(work_items, current_sprint):
+    moved = 0
+    for start in range(0, len(work_items), work_item_batch_size):
+        batch_items = work_items[start : start + work_item_batch_size]
+        batch = []
+        for work_item in batch_items:
+            batch.append(
+                {
+                    "method": "PATCH",
+                    "uri": f"/_apis/wit/workitems/{work_item.id}?api-version={api_version}",
+                    "headers": {"Content-Type": "application/json-patch+json"},
+                    "body": [
+                        {
+                            "op": "add",
+                            "path": "/fields/System.IterationPath",
+                            "value": current_sprint,
+                        }
+                    ],
+                }
+            )
+        # A failed chunk is reported and skipped, so the moved count stays accurate
+        try:
+            response = requests.post(
+                f"{organization_url}/_apis/wit/$batch?api-version={api_version}",
+                json=batch,
+                auth=("", PERSONAL_ACCESS_TOKEN),
+                timeout=batch_request_timeout,
+            )
+            response.raise_for_status()
+            results = response.json()["value"]
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Failed to move {len(batch_items)} work items: {e}")
+            continue
+        for work_item, result in zip(batch_items, results):
+            if result["code"] == 200:
+                print(f"Moved work item {work_item.id} to {current_sprint}")
+                moved += 1
+            else:
+                print(f"Failed to move work item {work_item.id}: {result['body']}")
+    return moved
+
+
+def get_wits_by_ids(work_item_ids, fields):
     wit_client = connection.clients.get_work_item_tracking_client()
-    return wit_client.get_work_item(work_item_id)
+    wits = []
+    for start in range(0, len(work_item_ids), work_item_batch_size):
+        wits.extend(
+            wit_client.get_work_items(
+                ids=work_item_ids[start : start + work_item_batch_size],
+                fields=fields,
+                error_policy="omit",
+            )
+        )
+    # Work items deleted since the query are returned as None
+    return [wit for wit in wits if wit is not None]
 
 
 def main():
@@ -156,6 +200,11 @@ def main():
         action="store_true",
         help="Simulate the actions without making any changes.",
     )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Update work items with the $batch endpoint instead of one at a time.",
+    )
 
     # Read arguments from command line
     args = parser.parse_args()
@@ -163,20 +212,32 @@ def main():
     # Define the list of users to move work items for
     assigned_to = [f"{args.assigned}", ""]
 
-    current_sprint = get_current_sprint(project_name, team_name)
+    project_id = get_project_id(project_name)
+    if not project_id:
+        raise Exception(f"Project {project_name} not found")
+    team_id = get_team_id(project_name, team_name)
+    if not team_id:
+        raise Exception(f"Team {team_name} not found")
+
+    current_sprint, excluded_sprints = get_sprints(project_id, team_id)
     if not current_sprint:
         raise Exception("Current sprint not found")
-    excluded_sprints = get_future_sprints(project_name, team_name)
     excluded_sprints.append(current_sprint)
     excluded_sprints.append(exclude_iteration_path)
     work_items = other_sprint_wits(excluded_sprints, assigned_to)
     if args.dry_run:
         print(f"{len(work_items)} work items would be moved")
-        for work_item in work_items:
-            wit = get_wit_by_id(work_item.id)
+        wits = get_wits_by_ids(
+            [work_item.id for work_item in work_items],
+            ["System.Id", "System.WorkItemType", "System.CreatedBy", "System.Title"],
+        )
+        for wit in wits:
             print(
                 f"{wit.id}|{wit.fields['System.WorkItemType']}|Created by {wit.fields['System.CreatedBy']['displayName']}|{wit.fields['System.Title']}"
             )
+    elif args.batch:
+        moved = move_wit_to_current_sprint_batch(work_items, current_sprint)
+        print(f"{moved} work items moved successfully")
     else:
         move_wit_to_current_sprint(work_items, current_sprint)
         print(f"{len(work_items)} work items moved successfully")
@@ -30,39 +30,13 @@ team_name = "Agents Runtime (RAGandOYDtoo)"
 credentials = BasicAuthentication("", personal_access_token)
 connection = Connection(base_url=organization_url, creds=credentials)
 
-# Get the work item tracking client and core client
+# Get the work item tracking client
 wit_client = connection.clients.get_work_item_tracking_client()
-core_client = connection.clients.get_core_client()
-
-# Get the project id
-project_id = None
-for project in core_client.get_projects():
-    if project.name == project_name:
-        project_id = project.id
-        print(f"Found project {project_name}, with ID {project_id}")
-        break
-
-# Get the team id
-team_id = None
-continue_search = True
-skipped_teams = 0
-while continue_search:
-    continue_search = False
-    for team in core_client.get_teams(project_id, skip=skipped_teams):
-        skipped_teams += 1
-        continue_search = True
-        if team.name == team_name:
-            team_id = team.id
-            print(f"Found team {team_name}, with ID {team_id}")
-            break
-    if team_id:
-        continue_search = False
-if not team_id:
-    raise Exception(f"Team {team_name} not found")
 
 # Find the current sprint
 current_sprint = None
-team_context = TeamContext = TeamContext(project_id=project_id, team_id=team_id)
+# The team context accepts project and team names, so no id lookups are needed
+team_context = TeamContext(project=project_name, team=team_name)
 today = datetime.datetime.now(datetime.UTC)
 # Get the work client
 work_client = connection.clients.get_work_client()
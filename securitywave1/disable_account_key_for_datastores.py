@@ -6,30 +6,75 @@
 #            also grant MSI the 'Storage Blob Data Contributor' role to that storage account.
 
 # Usage:
-#       python disable_account_key_for_datastores.py  -s SUBSCRIPTION_ID [-r RESOURCE_GROUP] [-w WORKSPACE_NAME] [-log LOGLEVEL] [-h]
+#       python disable_account_key_for_datastores.py  -s SUBSCRIPTION_ID [-r RESOURCE_GROUP] [-w WORKSPACE_NAME] [-log LOGLEVEL] [-t MAX_THREADS] [-h]
 
 # version: 0.2.0
 
 import argparse
+import functools
 import logging
+import logging.handlers
+import queue
 import uuid
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
-from azure.ai.ml import MLClient
-from azure.core.exceptions import ResourceExistsError
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.exceptions import HttpResponseError, ResourceExistsError
+from azure.core.pipeline.transport import RequestsTransport
 from azure.identity import DefaultAzureCredential
-from azure.mgmt.authorization import AuthorizationManagementClient
-from azure.mgmt.authorization.models import RoleAssignmentCreateParameters
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.storage import StorageManagementClient
-from azure.mgmt.storage.models import StorageAccountUpdateParameters
-from azureml.core.datastore import Datastore
-from azureml.core.workspace import Workspace
 
 current_file_name = Path(__file__).name
 
 logger = logging.getLogger(current_file_name)
 
+# shared by the Storage and Authorization clients; main() sizes its pool
+_session = requests.Session()
+
+# Number of concurrent tasks when migrating the datastores of one workspace
+task_graph_max_workers = 4
+
+
+@functools.cache
+def _credential():
+    # one credential per process, so the discovery chain runs once
+    return DefaultAzureCredential(exclude_visual_studio_code_credential=True)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_storage_client(subscription_id):
+    return StorageManagementClient(
+        _credential(),
+        subscription_id,
+        transport=RequestsTransport(session=_session, session_owner=False),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _get_auth_client(subscription_id):
+    return AuthorizationManagementClient(
+        _credential(),
+        subscription_id,
+        transport=RequestsTransport(session=_session, session_owner=False),
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_storage_properties(subscription_id, resource_group_name, storage_account_name):
+    # Several datastores can share a storage account, so cache its properties along
+    # with the ETag of the read; clear the cache after changing an account
+    storage_client = _get_storage_client(subscription_id)
+    return storage_client.storage_accounts.get_properties(
+        resource_group_name,
+        storage_account_name,
+        cls=lambda response, deserialized, _: (
+            deserialized,
+            response.http_response.headers.get("ETag"),
+        ),
+    )
+
 
 def _turn_off_shared_key_access(
     subscription_id, resource_group_name, storage_account_name
@@ -38,10 +83,11 @@ def _turn_off_shared_key_access(
         f"Disabling shared key access for storage account {storage_account_name} in resource group {resource_group_name}"
     )
 
-    storage_client = StorageManagementClient(DefaultAzureCredential(), subscription_id)
+    storage_client = _get_storage_client(subscription_id)
 
-    storage_properties = storage_client.storage_accounts.get_properties(
-        resource_group_name, storage_account_name
+    # Keep the ETag of the read so the update only applies to that version
+    storage_properties, etag = _get_storage_properties(
+        subscription_id, resource_group_name, storage_account_name
     )
 
     if storage_properties.allow_shared_key_access is False:
@@ -52,9 +98,28 @@ def _turn_off_shared_key_access(
 
     parameters = StorageAccountUpdateParameters(allow_shared_key_access=False)
 
-    storage_client.storage_accounts.update(
-        resource_group_name, storage_account_name, parameters
-    )
+    try:
+        storage_client.storage_accounts.update(
+            resource_group_name,
+            storage_account_name,
+            parameters,
+            headers={"If-Match": etag} if etag else None,
+        )
+    except HttpResponseError as e:
+        if e.status_code != 412:
+            raise
+        # The account changed since it was read, e.g. a concurrent run disabled the key
+        storage_properties = storage_client.storage_accounts.get_properties(
+            resource_group_name, storage_account_name
+        )
+        if storage_properties.allow_shared_key_access is not False:
+            raise
+        logger.info(
+            "Shared key access was disabled concurrently for this storage account. No action needed."
+        )
+    finally:
+        # The cached properties of this account are stale either way
+        _get_storage_properties.cache_clear()
 
 
 def _get_workspace_system_assigned_principal_id(workspace):
@@ -75,10 +140,8 @@ def _get_workspace_system_assigned_principal_id(workspace):
 def _grant_workspace_msi_access_to_storage(
     identity_principal_id, subscription_id, resource_group_name, storage_account_name
 ):
-    storage_client = StorageManagementClient(DefaultAzureCredential(), subscription_id)
-
-    storage_properties = storage_client.storage_accounts.get_properties(
-        resource_group_name, storage_account_name
+    storage_properties, _ = _get_storage_properties(
+        subscription_id, resource_group_name, storage_account_name
     )
 
     # Storage Blob Data Contributor role definition ID
@@ -95,13 +158,32 @@ def _grant_workspace_msi_access_to_storage(
     scope = storage_properties.id
 
     # https://learn.microsoft.com/en-us/python/api/azure-mgmt-authorization/azure.mgmt.authorization.v2022_04_01.operations.roleassignmentsoperations?view=azure-python#azure-mgmt-authorization-v2022-04-01-operations-roleassignmentsoperations-create
-    auth_client = AuthorizationManagementClient(
-        DefaultAzureCredential(), subscription_id
+    auth_client = _get_auth_client(subscription_id)
+
+    # Skip the write when the MSI already holds the role, the common case on reruns.
+    # The filter is applied server-side: only assignments of this principal that
+    # apply at this scope (directly or inherited) are returned.
+    for existing in auth_client.role_assignments.list_for_scope(
+        scope, filter=f"atScope() and assignedTo('{identity_principal_id}')"
+    ):
+        if (
+            existing.role_definition_id.lower()
+            == storage_blob_data_contributor_id.lower()
+        ):
+            logger.info(
+                f"Role assignment already exists for workspace MSI on storage account {storage_account_name}"
+            )
+            return
+
+    # Derive the assignment name from scope, principal and role so that retries and
+    # concurrent runs target the same assignment instead of creating new ones
+    role_assignment_name = uuid.uuid5(
+        uuid.NAMESPACE_URL,
+        f"{scope}|{identity_principal_id}|{storage_blob_data_contributor_id}",
     )
     try:
-        # Initialize the AuthorizationManagement client
         role_assignment = auth_client.role_assignments.create(
-            scope, uuid.uuid4(), parameters=role_params
+            scope, role_assignment_name, parameters=role_params
         )
         logger.info(
             f"Granting workspace 'Storage Blob Data Contributor' access to storage account {role_assignment}"
@@ -117,7 +199,61 @@ def _grant_workspace_msi_access_to_storage(
         raise
 
 
-def migrate_by_workspace(subscription_id, resource_group_name, workspace_name):
+def _register_datastore_with_msi(subscription_id, ws, datastore, resource_group_name):
+    # update the datastore to use the MSI
+    Datastore.register_azure_blob_container(
+        workspace=ws,
+        datastore_name=datastore.name,
+        container_name=datastore.container_name,
+        account_name=datastore.account_name,
+        sas_token=None,
+        account_key=None,
+        protocol=datastore.protocol,
+        endpoint=datastore.endpoint,
+        overwrite=True,
+        create_if_not_exists=False,
+        skip_validation=False,
+        blob_cache_timeout=None,
+        grant_workspace_access=True,
+        subscription_id=subscription_id,
+        resource_group=resource_group_name,
+    )
+
+
+def _run_task_graph(tasks, max_workers):
+    # tasks maps a task key to (func, dependency keys). Each task is started as soon as
+    # all of its dependencies have succeeded and is called with their results; a task
+    # whose dependency failed is not run and gets that dependency's exception.
+    results = {}
+    pending = dict(tasks)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for key, (func, deps) in list(pending.items()):
+                failed = [results[d] for d in deps if isinstance(results.get(d), Exception)]
+                if failed:
+                    results[key] = failed[0]
+                    del pending[key]
+                elif all(d in results for d in deps):
+                    running[executor.submit(func, *(results[d] for d in deps))] = key
+                    del pending[key]
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    results[key] = e
+    return results
+
+
+def migrate_by_workspace(
+    subscription_id, resource_group_name, workspace_name, storage_accounts
+):
+    # Returns the messages to print; resource groups run in worker threads, so main
+    # prints them in order rather than interleaving output from several workspaces
+    messages = []
     try:
         ws = Workspace.get(
             name=workspace_name,
@@ -128,126 +264,167 @@ def migrate_by_workspace(subscription_id, resource_group_name, workspace_name):
         logger.error(
             f"Error getting workspace {workspace_name} in resource group {resource_group_name}: {e}"
         )
-        return
+        return messages
 
     logger.info(f"== ResourceGroup:'{resource_group_name}' Workspace '{ws.name}' ==")
-    for datastore_name in ws.datastores:
-        datastore = Datastore.get(ws, datastore_name)
-        if datastore.datastore_type == "AzureBlob":
-            if datastore.credential_type != "AccountKey":
-                message = f"Datastore '{datastore_name}' in workspace '{ws.name}' is not using account key. Skipping."
-                logger.info(message)
-                print(message)
-                continue
-
-            # get storage account
-            storage_client = StorageManagementClient(
-                DefaultAzureCredential(), subscription_id
-            )
-            storage_accounts = storage_client.storage_accounts.list()
-
-            storage_account = next(
-                (sa for sa in storage_accounts if sa.name == datastore.account_name),
-                None,
-            )
-
-            if storage_account is None:
-                message = (
-                    f"Storage account '{datastore.account_name}' not found. Skipping."
-                )
-                logger.error(message)
-                print(message)
-                continue
-            # get resource group name from storage account id
-            storage_account_resource_group = storage_account.id.split("/")[4]
-
-            # disable the shared key
-            _turn_off_shared_key_access(
-                subscription_id, storage_account_resource_group, storage_account.name
-            )
 
-            try:
-                # The workspace system-assigned managed identity is included in the details
-                workspace_msi = _get_workspace_system_assigned_principal_id(ws)
-                _grant_workspace_msi_access_to_storage(
-                    workspace_msi,
+    # Collect the AzureBlob datastores still using an account key. The type comes from
+    # the listing; the credential type is read with Datastore.get for blob datastores
+    # only, so the check does not depend on the listing returning account keys.
+    datastores_to_migrate = []
+    for name, datastore in ws.datastores.items():
+        if datastore.datastore_type != "AzureBlob":
+            message = f"Datastore '{name}' in workspace '{ws.name}' is {datastore.datastore_type}. Skipping."
+            logger.info(message)
+            messages.append(message)
+            continue
+        datastore = Datastore.get(ws, name)
+        if datastore.credential_type != "AccountKey":
+            message = f"Datastore '{datastore.name}' in workspace '{ws.name}' is not using account key. Skipping."
+            logger.info(message)
+            messages.append(message)
+        else:
+            datastores_to_migrate.append(datastore)
+
+    # Build the migration as a task graph: the workspace MSI is fetched once, each
+    # storage account has its shared key disabled and the role granted independently,
+    # and each datastore is re-registered once both are done for its storage account.
+    tasks = {"msi": (lambda: _get_workspace_system_assigned_principal_id(ws), [])}
+    datastore_accounts = []
+    for datastore in datastores_to_migrate:
+        storage_account = storage_accounts.get(datastore.account_name)
+        if storage_account is None:
+            message = f"Storage account '{datastore.account_name}' not found. Skipping."
+            logger.error(message)
+            messages.append(message)
+            continue
+        account_name = storage_account.name
+        # get resource group name from storage account id
+        account_resource_group = storage_account.id.split("/")[4]
+        datastore_accounts.append((datastore, account_name))
+
+        if ("disable", account_name) not in tasks:
+            tasks[("disable", account_name)] = (
+                functools.partial(
+                    _turn_off_shared_key_access,
                     subscription_id,
-                    storage_account_resource_group,
-                    storage_account.name,
-                )
-            except Exception as e:
-                message = f"Fail to grant workspace the 'Storage Blob Data Contributor' access to storage account: {e}. Skipping."
-                logger.error(message)
-                print(message)
-                continue
-
-            # update the datastore to use the MSI
-            Datastore.register_azure_blob_container(
-                workspace=ws,
-                datastore_name=datastore.name,
-                container_name=datastore.container_name,
-                account_name=datastore.account_name,
-                sas_token=None,
-                account_key=None,
-                protocol=datastore.protocol,
-                endpoint=datastore.endpoint,
-                overwrite=True,
-                create_if_not_exists=False,
-                skip_validation=False,
-                blob_cache_timeout=None,
-                grant_workspace_access=True,
-                subscription_id=subscription_id,
-                resource_group=storage_account_resource_group,
+                    account_resource_group,
+                    account_name,
+                ),
+                [],
+            )
+            tasks[("grant", account_name)] = (
+                functools.partial(
+                    lambda rg, name, msi: _grant_workspace_msi_access_to_storage(
+                        msi, subscription_id, rg, name
+                    ),
+                    account_resource_group,
+                    account_name,
+                ),
+                ["msi"],
             )
+        tasks[("register", datastore.name)] = (
+            functools.partial(
+                lambda ds, rg, *_: _register_datastore_with_msi(
+                    subscription_id, ws, ds, rg
+                ),
+                datastore,
+                account_resource_group,
+            ),
+            [("disable", account_name), ("grant", account_name)],
+        )
 
-            # log the migration
-            message = f"Datastore '{datastore_name}' migrated to MSI-based access."
-            logger.info(message)
+    if not datastore_accounts:
+        return messages
+    results = _run_task_graph(tasks, max_workers=task_graph_max_workers)
+
+    for datastore, account_name in datastore_accounts:
+        grant_result = results[("grant", account_name)]
+        register_result = results[("register", datastore.name)]
+        if isinstance(grant_result, Exception):
+            message = f"Fail to grant workspace the 'Storage Blob Data Contributor' access to storage account: {grant_result}. Skipping."
+            logger.error(message)
+        elif isinstance(register_result, Exception):
+            message = f"Fail to migrate datastore '{datastore.name}' in workspace '{ws.name}': {register_result}"
+            logger.error(message)
         else:
-            message = f"Datastore '{datastore.name}' in workspace '{ws.name}' is {datastore.datastore_type}. Skipping."
+            # log the migration
+            message = f"Datastore '{datastore.name}' migrated to MSI-based access."
             logger.info(message)
-        print(message)
+        messages.append(message)
+    return messages
 
 
-def migrate_by_resource_group(subscription_id, resource_group_name, workspace_name):
-    # Get all workspace in this resource group except the 'hub' workspace
-    workspace_names = []
-    client = MLClient(DefaultAzureCredential(), subscription_id, resource_group_name)
-    if workspace_name is None:
-        workspace = client.workspaces.list()
-        workspace_names = [ws.name for ws in workspace if ws._kind != "hub"]
+def _list_workspace_names(subscription_id, resource_group_name, workspace_name):
+    # Get the names of all workspaces except the 'hub' workspace, by resource group
+    if resource_group_name is not None and workspace_name is not None:
+        return {resource_group_name: [workspace_name]}
+
+    if resource_group_name is None:
+        # One subscription-wide listing, so resource groups without workspaces cost nothing
+        workspaces = MLClient(_credential(), subscription_id).workspaces.list(
+            scope="subscription"
+        )
     else:
-        workspace_names.append(workspace_name)
+        workspaces = MLClient(
+            _credential(), subscription_id, resource_group_name
+        ).workspaces.list()
 
+    workspace_names = defaultdict(list)
+    for ws in workspaces:
+        if ws._kind != "hub" and workspace_name in (None, ws.name):
+            workspace_names[ws.resource_group].append(ws.name)
+    return workspace_names
+
+
+def migrate_by_resource_group(
+    subscription_id, resource_group_name, workspace_names, storage_accounts
+):
+    client = MLClient(_credential(), subscription_id, resource_group_name)
+
+    messages = []
     for workspace_name in workspace_names:
         message = f"\n==== ResourceGroup:'{resource_group_name}' Workspace:'{workspace_name}' ===="
         logger.info(message)
-        print(message)
-        migrate_by_workspace(subscription_id, resource_group_name, workspace_name)
+        messages.append(message)
+        messages += migrate_by_workspace(
+            subscription_id, resource_group_name, workspace_name, storage_accounts
+        )
 
         # Migrate the workspace to use identity-based authentication
         ws = client.workspaces.get(name=workspace_name)
         ws.system_datastores_auth_mode = "identity"
         ws = client.workspaces.begin_update(workspace=ws).result()
+    return messages
 
 
 def main(args):
-    # Acquire a credential object using default credentials
-    credential = DefaultAzureCredential()
-
-    # Obtain the management object for resources
-    resource_groups = []
-    if args.resource_group is None:
-        resource_client = ResourceManagementClient(credential, args.subscription_id)
-        # Retrieve the list of resource groups
-        resource_groups = [rg.name for rg in resource_client.resource_groups.list()]
-    else:
-        resource_groups.append(args.resource_group)
+    # Up to max_threads resource groups each run task_graph_max_workers calls at once;
+    # the default pool of 10 connections would discard connections beyond that
+    pool_size = args.max_threads * task_graph_max_workers
+    _session.mount(
+        "https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    )
 
-    for resource_group_name in resource_groups:
-        migrate_by_resource_group(
-            args.subscription_id, resource_group_name, args.workspace_name
-        )
+    workspace_names = _list_workspace_names(
+        args.subscription_id, args.resource_group, args.workspace_name
+    )
+
+    # List the subscription's storage accounts once, keyed by name, for all datastores
+    storage_client = _get_storage_client(args.subscription_id)
+    storage_accounts = {sa.name: sa for sa in storage_client.storage_accounts.list()}
+
+    # Migrate resource groups concurrently and print their messages here in resource
+    # group order; iterating the results re-raises any worker error
+    with ThreadPoolExecutor(max_workers=args.max_threads) as executor:
+        for messages in executor.map(
+            lambda rg: migrate_by_resource_group(
+                args.subscription_id, rg, workspace_names[rg], storage_accounts
+            ),
+            workspace_names,
+        ):
+            for message in messages:
+                print(message)
 
 
 if __name__ == "__main__":
@@ -258,13 +435,41 @@ if __name__ == "__main__":
     parser.add_argument(
         "-log", "--loglevel", default="WARNING", help="Set the logging level"
     )
+    parser.add_argument(
+        "-t",
+        "--max_threads",
+        type=int,
+        default=8,
+        help="Number of resource groups to migrate concurrently",
+    )
     args = parser.parse_args()
 
-    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+    # The SDKs are slow to import, so load them only after "--help" and argument
+    # errors have returned, and on the main thread before any worker starts
+    from azure.ai.ml import MLClient
+    from azure.mgmt.authorization import AuthorizationManagementClient
+    from azure.mgmt.authorization.models import RoleAssignmentCreateParameters
+    from azure.mgmt.storage import StorageManagementClient
+    from azure.mgmt.storage.models import StorageAccountUpdateParameters
+    from azureml.core.datastore import Datastore
+    from azureml.core.workspace import Workspace
+
+    # Worker threads only enqueue log records; a single listener thread writes them,
+    # so logging does not serialize the migration threads on the stream handler
+    log_queue = queue.SimpleQueue()
+    logging.basicConfig(
+        level=getattr(logging, args.loglevel.upper()),
+        handlers=[logging.handlers.QueueHandler(log_queue)],
+    )
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
 
-    logger.info("\n".join(f"{k}={v}" for k, v in vars(args).items()))
+    try:
+        logger.info("\n".join(f"{k}={v}" for k, v in vars(args).items()))
 
-    if args.subscription_id is None:
-        raise ValueError("Subscription ID must be provided.")
+        if args.subscription_id is None:
+            raise ValueError("Subscription ID must be provided.")
 
-    main(args)
+        main(args)
+    finally:
+        listener.stop()
@@ -4,91 +4,110 @@
 # version: 0.1.0
 
 import argparse
+import functools
 import logging
-from collections import namedtuple
 from pathlib import Path
 
+import requests
+from azure.core.pipeline.transport import RequestsTransport
 from azure.identity import DefaultAzureCredential
-from azure.mgmt.resource import ResourceManagementClient
 from azure.mgmt.storage import StorageManagementClient
 
-StorageAccount = namedtuple(
-    "StorageAccount",
-    ["name", "resource_group", "subscription_id", "allow_shared_key_access"],
-)
-
 current_file_name = Path(__file__).name
 
 logger = logging.getLogger(current_file_name)
 
-
-def _is_shared_key_access_allowed(
-    subscription_id, resource_group_name, storage_account_name
-):
-    logger.info(
-        f"Getting shared key access setting for storage account {storage_account_name} in resource group {resource_group_name}"
-    )
-
-    storage_client = StorageManagementClient(DefaultAzureCredential(), subscription_id)
-
-    storage_properties = storage_client.storage_accounts.get_properties(
-        resource_group_name, storage_account_name
+# reused by every storage client call
+_session = requests.Session()
+
+
+@functools.cache
+def _credential():
+    # one credential per process; VS Code sign-in is not used from a shell
+    return DefaultAzureCredential(exclude_visual_studio_code_credential=True)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_storage_client(subscription_id):
+    # This is a read-only scan, so fail fast on unhealthy calls instead of using the
+    # SDK's default retries and backoff; the user can simply rerun
+    return StorageManagementClient(
+        _credential(),
+        subscription_id,
+        transport=RequestsTransport(
+            session=_session,
+            session_owner=False,
+            connection_timeout=5,
+            read_timeout=30,
+        ),
+        retry_total=2,
+        retry_backoff_factor=0.2,
     )
 
-    return storage_properties.allow_shared_key_access
-
 
 def list_by_resource_group(subscription_id, resource_group_name):
     logger.info(f"Listing storage accounts in resource group {resource_group_name}")
 
-    storage_accounts = []
-    storage_client = StorageManagementClient(DefaultAzureCredential(), subscription_id)
+    # Keep names and shared key flags as parallel lists, the only fields used
+    names = []
+    allow_flags = []
+    storage_client = _get_storage_client(subscription_id)
 
     for storage_account in storage_client.storage_accounts.list_by_resource_group(
         resource_group_name
     ):
-        allow_shared_key_access = _is_shared_key_access_allowed(
-            subscription_id, resource_group_name, storage_account.name
-        )
-        storage_accounts.append(
-            StorageAccount(
-                storage_account.name,
-                resource_group_name,
-                subscription_id,
-                allow_shared_key_access,
-            )
+        # The listed accounts already carry the shared key access setting
+        names.append(storage_account.name)
+        allow_flags.append(storage_account.allow_shared_key_access)
+    return names, allow_flags
+
+
+def list_by_subscription(subscription_id):
+    logger.info(f"Listing storage accounts in subscription {subscription_id}")
+
+    # Bucket the accounts by the resource group segment of their id. Its casing can
+    # differ between accounts of one resource group, so group case-insensitively and
+    # keep the first spelling seen for display.
+    storage_accounts = {}
+    storage_client = _get_storage_client(subscription_id)
+
+    for storage_account in storage_client.storage_accounts.list():
+        resource_group_name = storage_account.id.split("/")[4]
+        _, names, allow_flags = storage_accounts.setdefault(
+            resource_group_name.lower(), (resource_group_name, [], [])
         )
-    return storage_accounts
+        names.append(storage_account.name)
+        allow_flags.append(storage_account.allow_shared_key_access)
+    return {
+        resource_group_name: (names, allow_flags)
+        for resource_group_name, names, allow_flags in storage_accounts.values()
+    }
 
 
 def main(args):
-    # Acquire a credential object using default credentials
-    credential = DefaultAzureCredential()
-
-    # Obtain the management object for resources
-    resource_groups = []
     if args.resource_group is None:
-        resource_client = ResourceManagementClient(credential, args.subscription_id)
-        # Retrieve the list of resource groups
-        resource_groups = [rg.name for rg in resource_client.resource_groups.list()]
+        # One subscription-wide listing only yields resource groups that hold storage
+        # accounts, so empty resource groups cost no calls
+        storage_accounts = list_by_subscription(args.subscription_id)
     else:
-        resource_groups.append(args.resource_group)
+        storage_accounts = {
+            args.resource_group: list_by_resource_group(
+                args.subscription_id, args.resource_group
+            )
+        }
 
     total_storage_accounts_with_shared_key_access = 0
-    for resource_group_name in resource_groups:
-        storage_accounts = list_by_resource_group(
-            args.subscription_id, resource_group_name
-        )
-        if len(storage_accounts) != 0:
-            count = len([s for s in storage_accounts if s.allow_shared_key_access])
+    for resource_group_name, (names, allow_flags) in storage_accounts.items():
+        if len(names) != 0:
+            count = sum(map(bool, allow_flags))
             total_storage_accounts_with_shared_key_access += count
             print(
                 f"=== {count} Storage account(s) in resource group '{resource_group_name}' allow shared key access ==="
             )
-        for storage_account in storage_accounts:
-            if args.all or storage_account.allow_shared_key_access:
+        for name, allow_shared_key_access in zip(names, allow_flags):
+            if args.all or allow_shared_key_access:
                 print(
-                    f"  Storage account: {storage_account.name} \tAllow shared key access: {storage_account.allow_shared_key_access}"
+                    f"  Storage account: {name} \tAllow shared key access: {allow_shared_key_access}"
                 )
     # Print the total number of storage accounts with shared key access
     print("\n" + "=" * 80)